@@ -4,9 +4,14 @@ import logging
 # Function to normalize array by rows
 def normalize_by_rows(array):
     row_sums = np.sum(array,
-                      axis=1,
+                      axis=-1,
                       keepdims=True)
-    array /= row_sums
+    return array / row_sums
+
+# Function to create a read-only copy of an array
+def read_only_copy(array):
+    array = np.array(array, copy=True)
+    array.flags.writeable = False
     return array
 
 # D'Hondt method
@@ -15,14 +20,13 @@ def dhondt_method(array_of_all_list_votes,
     logging.debug("Calculating D'Hondt mandates for array %s..." % array_of_all_list_votes)
     array_of_divisors = np.arange(1, 61)
     array_of_divisors = np.expand_dims(array_of_divisors, axis=1)
-    dhondt_matrix = np.divide(np.tile(array_of_all_list_votes,(60, 1)),
+    dhondt_matrix = np.divide(np.expand_dims(array_of_all_list_votes, axis=-2),
                               array_of_divisors)
-    temp_array = np.sort(dhondt_matrix.ravel())
-    temp_array = temp_array[np.nonzero(temp_array)]
-    if len(temp_array) < num_mandates:
-        smallest_mandate_limit = temp_array[-1]
-    else:
-        smallest_mandate_limit = temp_array[-num_mandates]
+    temp_array = np.sort(dhondt_matrix.reshape(dhondt_matrix.shape[:-2] + (-1,)), axis=-1)
+    num_nonzero = np.count_nonzero(temp_array, axis=-1)
+    smallest_mandate_limit = np.where(num_nonzero < num_mandates,
+                                      temp_array[..., -1],
+                                      temp_array[..., -num_mandates])
     logging.debug("Smallest limit for D'Hondt mandates was determined to be %s." % smallest_mandate_limit)
     return dhondt_matrix, smallest_mandate_limit
 
@@ -1,6 +1,8 @@
+import itertools
 import logging
 import numpy as np
 import helpers
+from results import ElasticityResults, MandateResults
 
 
 # Custom exception
@@ -13,6 +15,7 @@ class MandateCalculator:
     NUM_POLITICAL_FORMATIONS = 4  # Number of political formations to handle
     NUM_SMDS = 106  # Number of SMDs
     VOTE_LIMIT = 0.05  # Ratio of minimal votes
+    ELASTICITY_CHUNK_SIZE = 100  # Number of grid points calculated as a single batch by elasticity calculations
 
     array_of_earlier_results = None  # Numpy array of results from the last election for every SMD
     num_smd_votes = None  # Numpy array of number of votes from the last election for every SMD
@@ -35,62 +38,86 @@ class MandateCalculator:
         logging.debug("Initializing MandateCalculator object is in progress...")
 
         self.__validate_smd_party_matrix(array_of_earlier_results)
-        self.array_of_earlier_results = array_of_earlier_results
+        self.array_of_earlier_results = helpers.read_only_copy(array_of_earlier_results)
         logging.debug("The array of earlier results for every SMD is of size %s, %s." % array_of_earlier_results.shape)
 
         self.__validate_num_votes_smd(num_smd_votes)
-        self.num_smd_votes = num_smd_votes
+        self.num_smd_votes = helpers.read_only_copy(num_smd_votes)
         logging.debug("The array of SMD vote counts from the last election successfully set!")
 
         self.__validate_vector(factual_ratios, human_readable_name="factual national ratios")
-        self.factual_ratios = factual_ratios
+        self.factual_ratios = helpers.read_only_copy(factual_ratios)
         logging.debug("The array of factual national results is %s." % factual_ratios)
 
         self.__validate_vector(predicted_ratios, human_readable_name="predicted national ratios")
-        self.predicted_ratios = predicted_ratios
+        self.predicted_ratios = helpers.read_only_copy(predicted_ratios)
         logging.debug("The array of predicted national results is %s." % predicted_ratios)
 
         self.__validate_vector(votes_from_abroad, human_readable_name="votes from abroad")
-        self.votes_from_abroad = votes_from_abroad
+        self.votes_from_abroad = helpers.read_only_copy(votes_from_abroad)
         logging.debug("The array of votes from abroad is %s." % votes_from_abroad)
 
         self.__validate_smd_party_matrix(region_smd_array)
-        self.region_smd_array = region_smd_array
+        self.region_smd_array = helpers.read_only_copy(region_smd_array)
         logging.debug("The array of SMD corrections for every SMD is of size %s, %s." % region_smd_array.shape)
 
-        self.ratio_predicted_factual = self.__calculate_ratio_predicted_factual(predicted_ratios=predicted_ratios)
+        self.ratio_predicted_factual = helpers.read_only_copy(
+            self.__calculate_ratio_predicted_factual(predicted_ratios=self.predicted_ratios))
 
+        self.__initialized = True  # Attributes cannot be set or deleted from now on
         logging.debug("MandateCalculator object was successfully initialized!")
 
+    # Block setting attributes after initialization
+    def __setattr__(self, name, value):
+        if self.__dict__.get("_MandateCalculator__initialized", False):
+            raise MandateCalculatorException("MandateCalculator objects are immutable, "
+                                             "create a new one to change %s!" % name)
+        self.__dict__[name] = value
+
+    # Block deleting attributes after initialization
+    def __delattr__(self, name):
+        if self.__dict__.get("_MandateCalculator__initialized", False):
+            raise MandateCalculatorException("MandateCalculator objects are immutable, "
+                                             "create a new one to change %s!" % name)
+        del self.__dict__[name]
+
 
     ##################### Public methods ###################
     # Calculate final list mandates
     def calculate_mandates(self, all_list_votes, smd_winners):
+        smd_mandates = self.calculate_smd_mandates(smd_winners=smd_winners)
+        list_mandates = self.calculate_list_mandates(all_list_votes=all_list_votes)
+        return smd_mandates, list_mandates
+
+    # Calculate list mandates with the D'Hondt method
+    def calculate_list_mandates(self, all_list_votes):
         dhondt_matrix, smallest_mandate_limit = helpers.dhondt_method(array_of_all_list_votes=all_list_votes,
                                                                       num_mandates=93)
-        list_mandates = np.sum(dhondt_matrix >= smallest_mandate_limit, axis=0)
-        sum_list_mandates = np.sum(list_mandates)
-        if sum_list_mandates < 93:
-            list_mandates /= sum_list_mandates
-            list_mandates *= 93
-        smd_mandates = np.sum(smd_winners, axis=0)
-        return smd_mandates, list_mandates
+        smallest_mandate_limit = np.expand_dims(np.expand_dims(smallest_mandate_limit, axis=-1), axis=-1)
+        list_mandates = np.sum(dhondt_matrix >= smallest_mandate_limit, axis=-2)
+        sum_list_mandates = np.sum(list_mandates, axis=-1, keepdims=True)
+        return np.where(sum_list_mandates < 93,
+                        list_mandates / sum_list_mandates * 93,
+                        list_mandates)
+
+    # Calculate SMD mandates
+    def calculate_smd_mandates(self, smd_winners):
+        return np.sum(smd_winners, axis=-2)
 
     # Calculate SMD votes according to predicted national ratios
     def calculate_predicted_smd_ratios(self, ratio_predicted_factual = None, normalize_stepwise=True):
         if ratio_predicted_factual is None:
             ratio_predicted_factual = self.ratio_predicted_factual
         logging.debug("Calculating SMD votes according to predicted national ratios...")
-        temp_array = np.tile(ratio_predicted_factual,
-                             (self.NUM_SMDS, 1))
+        temp_array = np.expand_dims(ratio_predicted_factual, axis=-2)
         if normalize_stepwise:
             normalized_smd_array = helpers.normalize_by_rows(self.array_of_earlier_results)
-            temp_array *= normalized_smd_array
+            temp_array = temp_array * normalized_smd_array
             normalized_predicted_smd_votes = helpers.normalize_by_rows(temp_array)
             normalized_predicted_smd_votes *= self.region_smd_array # Regional correction
             normalized_regional_votes = helpers.normalize_by_rows(normalized_predicted_smd_votes)
         else:
-            temp_array *= self.array_of_earlier_results
+            temp_array = temp_array * self.array_of_earlier_results
             temp_array *= self.region_smd_array # Regional correction
             normalized_regional_votes = helpers.normalize_by_rows(temp_array)
 
@@ -100,7 +127,7 @@ class MandateCalculator:
     def determine_smd_winners(self, smd_predicted_array):
         logging.debug("Determining SMD winners...")
         max_votes = np.max(smd_predicted_array,
-                           axis=1,
+                           axis=-1,
                            keepdims=True)
         return np.equal(smd_predicted_array, max_votes)
 
@@ -108,21 +135,23 @@ class MandateCalculator:
     def determine_smd_second_largest_vote_ratios(self, smd_predicted_array):
         logging.debug("Determining SMD second largest vote ratios...")
         max_votes = np.max(smd_predicted_array,
-                           axis=1,
+                           axis=-1,
                            keepdims=True)
         temp_array = np.not_equal(smd_predicted_array, max_votes)
         temp_array = temp_array * smd_predicted_array
-        return np.max(temp_array, axis=1, keepdims=True)
+        return np.max(temp_array, axis=-1, keepdims=True)
 
     # Determine fractional votes without winner compensation
-    def calculate_fractional_votes_without_winner_compensation(self, smd_predicted_array):
+    def calculate_fractional_votes_without_winner_compensation(self, smd_predicted_array, num_smd_votes=None):
         logging.debug("Calculating fractional votes without winner compensation...")
+        if num_smd_votes is None:
+            num_smd_votes = self.num_smd_votes
         max_votes = np.max(smd_predicted_array,
-                           axis=1,
+                           axis=-1,
                            keepdims=True)
         temp_array = np.not_equal(smd_predicted_array, max_votes)
         temp_array = temp_array * smd_predicted_array
-        temp_array *= self.num_smd_votes
+        temp_array = temp_array * num_smd_votes
         return np.floor(temp_array)
 
     # Calculate fractional votes with winner compensation
@@ -130,31 +159,37 @@ class MandateCalculator:
                                                             smd_predicted_array,
                                                             smd_winners,
                                                             smd_second_largest_votes,
-                                                            fractional_votes_without_winner_comp):
+                                                            fractional_votes_without_winner_comp,
+                                                            num_smd_votes=None):
         logging.debug("Calculating fractional votes with winner compensation...")
+        if num_smd_votes is None:
+            num_smd_votes = self.num_smd_votes
         max_votes = np.max(smd_predicted_array,
-                           axis=1,
+                           axis=-1,
                            keepdims=True)
         max_votes = max_votes * smd_winners
         diff_largest_second_largest = max_votes - smd_second_largest_votes
-        temp_array = diff_largest_second_largest * self.num_smd_votes
-        temp_array *= smd_winners
-        temp_array += fractional_votes_without_winner_comp
+        temp_array = diff_largest_second_largest * num_smd_votes
+        temp_array = temp_array * smd_winners
+        temp_array = temp_array + fractional_votes_without_winner_comp
         return np.floor(temp_array)
 
     # Calculate all votes
     def calculate_all_list_votes(self,
                                  fractional_votes_with_winner_comp,
-                                 predicted_ratios = None):
+                                 predicted_ratios = None,
+                                 num_smd_votes = None):
         logging.debug("Calculating all list votes...")
         if predicted_ratios is None:
             predicted_ratios = self.predicted_ratios
+        if num_smd_votes is None:
+            num_smd_votes = self.num_smd_votes
 
         # Calculate sum of fractional votes with winner compensation
-        fractional_vote_sum = np.sum(fractional_votes_with_winner_comp, axis=0)
+        fractional_vote_sum = np.sum(fractional_votes_with_winner_comp, axis=-2)
 
         # National list votes
-        all_votes = np.sum(self.num_smd_votes, axis=0)
+        all_votes = np.sum(num_smd_votes, axis=-2)
         all_votes = all_votes * predicted_ratios
 
         # Above the limit?
@@ -165,33 +200,114 @@ class MandateCalculator:
     # Helper function to calculate all mandates
     def calculate_all_mandates(self,
                                predicted_ratios = None,
-                               ratio_predicted_factual = None):
+                               ratio_predicted_factual = None,
+                               num_smd_votes = None,
+                               turnout_multipliers = None):
         logging.debug("Calculating all mandates...")
+        results = self.calculate_results(predicted_ratios=predicted_ratios,
+                                         ratio_predicted_factual=ratio_predicted_factual,
+                                         num_smd_votes=num_smd_votes,
+                                         turnout_multipliers=turnout_multipliers)
+        list_mandates = np.array(results.list_mandates)
+        # SMD mandates do not depend on turnout, broadcast them to the turnout scenarios of the list mandates
+        smd_mandates = np.array(np.broadcast_to(results.smd_mandates,
+                                                np.broadcast(results.smd_mandates, list_mandates).shape))
+        return smd_mandates, list_mandates
+
+    # Create a lazily evaluated result object computing every stage on first access
+    def calculate_results(self,
+                          predicted_ratios = None,
+                          ratio_predicted_factual = None,
+                          num_smd_votes = None,
+                          turnout_multipliers = None):
         if ratio_predicted_factual is None:
-            ratio_predicted_factual = self.ratio_predicted_factual
+            if predicted_ratios is not None and np.ndim(predicted_ratios) > 1:
+                # A batch of scenarios cannot fall back to the ratio of the single predicted scenario
+                ratio_predicted_factual = self.__calculate_ratio_predicted_factual(predicted_ratios=predicted_ratios)
+            else:
+                ratio_predicted_factual = self.ratio_predicted_factual
         if predicted_ratios is None:
             predicted_ratios = self.predicted_ratios
-        predicted_smd_votes = self.calculate_predicted_smd_ratios(ratio_predicted_factual=ratio_predicted_factual)
-        smd_winners = self.determine_smd_winners(smd_predicted_array=predicted_smd_votes)
-        smd_second_largest_votes = self.determine_smd_second_largest_vote_ratios(
-            smd_predicted_array=predicted_smd_votes)
-        fractional_votes_without_winner_comp = self.calculate_fractional_votes_without_winner_compensation(
-            smd_predicted_array=predicted_smd_votes)
-        fractional_votes_with_winner_comp = self.calculate_fractional_votes_with_winner_compensation(
-            smd_predicted_array=predicted_smd_votes,
-            smd_winners=smd_winners,
-            smd_second_largest_votes=smd_second_largest_votes,
-            fractional_votes_without_winner_comp=fractional_votes_without_winner_comp)
-        all_list_votes = self.calculate_all_list_votes(
-            fractional_votes_with_winner_comp=fractional_votes_with_winner_comp,
-            predicted_ratios=predicted_ratios)
-        smd_mandates, list_mandates = self.calculate_mandates(all_list_votes=all_list_votes,
-                                                              smd_winners=smd_winners)
-        return smd_mandates, list_mandates
+        if np.shape(predicted_ratios) != np.shape(ratio_predicted_factual):
+            raise MandateCalculatorException("The shapes of predicted national ratios %s and of ratios of predicted "
+                                             "and factual national values %s do not match!"
+                                             % (np.shape(predicted_ratios), np.shape(ratio_predicted_factual)))
+        num_smd_votes = self.calculate_turnout(num_smd_votes=num_smd_votes,
+                                               turnout_multipliers=turnout_multipliers)
+        try:
+            np.broadcast(np.expand_dims(ratio_predicted_factual, -2), num_smd_votes)
+        except ValueError:
+            raise MandateCalculatorException("The turnout scenarios of shape %s cannot be broadcast against the "
+                                             "predicted national ratios of shape %s! Give predicted ratios of "
+                                             "shape (n, 1, 4) to combine n polls with turnout scenarios."
+                                             % (np.shape(num_smd_votes), np.shape(ratio_predicted_factual)))
+        return MandateResults(calculator=self,
+                              predicted_ratios=predicted_ratios,
+                              ratio_predicted_factual=ratio_predicted_factual,
+                              num_smd_votes=num_smd_votes)
+
+    # Calculate SMD vote counts of a turnout scenario from absolute counts and/or per-SMD multipliers
+    def calculate_turnout(self, num_smd_votes=None, turnout_multipliers=None):
+        if num_smd_votes is None:
+            num_smd_votes = self.num_smd_votes
+        else:
+            self.__validate_turnout(num_smd_votes, human_readable_name="SMD vote counts")
+        if turnout_multipliers is not None:
+            logging.debug("Applying turnout multipliers to SMD vote counts...")
+            self.__validate_turnout(turnout_multipliers, human_readable_name="turnout multipliers")
+            num_smd_votes = num_smd_votes * turnout_multipliers
+        return num_smd_votes
 
     # Function to calculate elasticities
-    def calculate_elasticities(self, fixed_party_indicies, granularity=None, support_threshold=None):
+    def calculate_elasticities(self, fixed_party_indicies, granularity=None, support_threshold=None, chunk_size=None):
         logging.debug("Calculating elasticities...")
+        results = []  # List to store results in
+        for chunk in self.iterate_elasticities(fixed_party_indicies=fixed_party_indicies,
+                                               granularity=granularity,
+                                               support_threshold=support_threshold,
+                                               chunk_size=chunk_size):
+            results.extend(chunk)
+        return results
+
+    # Generator of elasticities yielding the list of results of every chunk of the support grid when it is finished
+    # (arguments are validated on the call itself, before the generator is returned)
+    def iterate_elasticities(self, fixed_party_indicies, granularity=None, support_threshold=None, chunk_size=None):
+        logging.debug("Iterating elasticities...")
+        non_fixed_parties, available_support, granularity = self.__prepare_elasticities(
+            fixed_party_indicies=fixed_party_indicies,
+            granularity=granularity)
+        chunk_size = self.__prepare_chunk_size(chunk_size)
+        chunks = self.__iterate_elasticity_chunks(non_fixed_parties=non_fixed_parties,
+                                                  available_support=available_support,
+                                                  granularity=granularity,
+                                                  support_threshold=support_threshold,
+                                                  chunk_size=chunk_size)
+        return ([[i, available_support - i] + relevant_mandates for grid_index, i, relevant_mandates in chunk]
+                for chunk in chunks)
+
+    # Function to calculate elasticities as run-length encoded segments of constant mandates
+    def calculate_compact_elasticities(self, fixed_party_indicies, granularity=None, support_threshold=None,
+                                       chunk_size=None):
+        logging.debug("Calculating compact elasticities...")
+        non_fixed_parties, available_support, granularity = self.__prepare_elasticities(
+            fixed_party_indicies=fixed_party_indicies,
+            granularity=granularity)
+        chunk_size = self.__prepare_chunk_size(chunk_size)
+        points = ((grid_index, relevant_mandates[0], relevant_mandates[1])
+                  for chunk in self.__iterate_elasticity_chunks(non_fixed_parties=non_fixed_parties,
+                                                                available_support=available_support,
+                                                                granularity=granularity,
+                                                                support_threshold=support_threshold,
+                                                                chunk_size=chunk_size)
+                  for grid_index, i, relevant_mandates in chunk)
+        return ElasticityResults.from_grid(points=points,
+                                           granularity=granularity,
+                                           available_support=available_support,
+                                           party_indices=non_fixed_parties)
+
+    ##################### Private methods ###################
+    # Validate fixed parties and determine the non-fixed parties, their available support and the grid step
+    def __prepare_elasticities(self, fixed_party_indicies, granularity):
         if not isinstance(fixed_party_indicies, list):
             raise MandateCalculatorException("Fixed party indices should be provided as a list!")
         if len(fixed_party_indicies) != 2:
@@ -202,28 +318,50 @@ class MandateCalculator:
         available_support = 100 - float(np.sum(self.predicted_ratios[fixed_party_indicies])) * 100
         if granularity is None:
             granularity = 0.5
-        results = []  # List to store results in
-        for i in helpers.frange(0 + granularity, int(available_support), granularity):
-            temp_array = self.predicted_ratios.copy()
+        return non_fixed_parties, available_support, granularity
+
+    # Validate the number of grid points calculated as a single batch
+    def __prepare_chunk_size(self, chunk_size):
+        if chunk_size is None:
+            return self.ELASTICITY_CHUNK_SIZE
+        if isinstance(chunk_size, bool) or not isinstance(chunk_size, (int, long, np.integer)) or chunk_size < 1:
+            raise MandateCalculatorException("Chunk size should be a positive integer!")
+        return int(chunk_size)
+
+    # Iterate over the points of the support grid that pass the support threshold
+    def __iterate_support_grid(self, available_support, granularity, support_threshold):
+        for grid_index, i in enumerate(helpers.frange(0 + granularity, int(available_support), granularity)):
             party_a_support = i / 100.0
             party_b_support = (available_support - i) / 100
-
-            calculate = True
             if support_threshold is not None:
                 if abs(party_a_support - party_b_support) > support_threshold:
-                    calculate = False
-            if calculate:
-                temp_array[non_fixed_parties] = [party_a_support, party_b_support]
-                smd_mandates, list_mandates = self.calculate_all_mandates(
-                    ratio_predicted_factual=self.__calculate_ratio_predicted_factual(predicted_ratios=temp_array),
-                    predicted_ratios=temp_array)
-                smd_mandates += list_mandates
-                relevant_mandates = smd_mandates[non_fixed_parties].tolist()
-                result = [i, available_support - i] + relevant_mandates
-                results.append(result)
-        return results
+                    continue
+            yield grid_index, i, party_a_support, party_b_support
+
+    # Iterate over chunks of the support grid, calculating every chunk as a single batch and yielding
+    # a list of (grid index, support, mandates of non-fixed parties) tuples
+    def __iterate_elasticity_chunks(self, non_fixed_parties, available_support, granularity, support_threshold,
+                                    chunk_size):
+        support_grid = self.__iterate_support_grid(available_support=available_support,
+                                                   granularity=granularity,
+                                                   support_threshold=support_threshold)
+        while True:
+            grid_points = list(itertools.islice(support_grid, chunk_size))
+            if not grid_points:
+                break
+            logging.debug("Calculating elasticity chunk of %s grid points..." % len(grid_points))
+            temp_array = np.tile(self.predicted_ratios, (len(grid_points), 1))
+            temp_array[:, non_fixed_parties] = [[party_a_support, party_b_support]
+                                                for grid_index, i, party_a_support, party_b_support in grid_points]
+            smd_mandates, list_mandates = self.calculate_all_mandates(
+                ratio_predicted_factual=self.__calculate_ratio_predicted_factual(predicted_ratios=temp_array),
+                predicted_ratios=temp_array)
+            smd_mandates = smd_mandates + list_mandates
+            relevant_mandates = smd_mandates[:, non_fixed_parties].tolist()
+            yield [(grid_index, i, mandates)
+                   for (grid_index, i, party_a_support, party_b_support), mandates in zip(grid_points,
+                                                                                           relevant_mandates)]
 
-    ##################### Private methods ###################
     # Calculate the ratio between predicted and factual national values
     def __calculate_ratio_predicted_factual(self, predicted_ratios):
         logging.debug("Calculating ratio between predicted and actual national ratios...")
@@ -283,6 +421,25 @@ class MandateCalculator:
 
         return True
 
+    # Function to validate SMD vote counts or turnout multipliers of turnout scenarios
+    def __validate_turnout(self, array_to_validate, human_readable_name="turnout multipliers"):
+
+        # Validate that array is in fact a numpy array
+        if not isinstance(array_to_validate, (np.ndarray, np.generic)):
+            raise MandateCalculatorException("The provided array of %s is not a numpy array!"
+                                             % human_readable_name)
+
+        # Validate that the last two axes are SMDs and a single column
+        if array_to_validate.ndim < 2 or array_to_validate.shape[-1] != 1:
+            raise MandateCalculatorException("The provided array of %s should have a single column "
+                                             "for every SMD!" % human_readable_name)
+
+        if array_to_validate.shape[-2] != self.NUM_SMDS:
+            raise MandateCalculatorException("The number of rows in the array of %s "
+                                             "does not equal the number of SMDs!" % human_readable_name)
+
+        return True
+
     # Function to validate that the provided value is in fact a ratio
     def __validate_vector(self, array_to_validate, human_readable_name="votes"):
 
@@ -0,0 +1,206 @@
+import json
+import logging
+import numpy as np
+
+
+# Structured dtype of a run of constant mandates on the elasticity grid
+SEGMENT_DTYPE = np.dtype([('index', np.int64),  # Grid index of the first point of the run
+                          ('length', np.int64),  # Number of consecutive grid points in the run
+                          ('mandates_a', np.int64),  # Mandates of the first non-fixed party
+                          ('mandates_b', np.int64)])  # Mandates of the second non-fixed party
+
+# Structured dtype of a single point of the expanded elasticity grid
+POINT_DTYPE = np.dtype([('support_a', np.float64),
+                        ('support_b', np.float64),
+                        ('mandates_a', np.int64),
+                        ('mandates_b', np.int64)])
+
+
+class ElasticityResults:
+
+    segments = None  # Numpy structured array of run-length encoded segments (see SEGMENT_DTYPE)
+    granularity = None  # Step of the support grid in percentage points
+    available_support = None  # Support shared by the two non-fixed parties in percentage points
+    party_indices = None  # Indices of the two non-fixed political formations
+
+    # Constructor
+    def __init__(self, segments, granularity, available_support, party_indices):
+        self.segments = np.asarray(segments, dtype=SEGMENT_DTYPE)
+        self.granularity = float(granularity)
+        self.available_support = float(available_support)
+        self.party_indices = [int(index) for index in party_indices]
+        logging.debug("Elasticity results hold %s points in %s segments." % (len(self), len(self.segments)))
+
+    # Build results from (grid index, mandates of party a, mandates of party b) tuples in grid order
+    @classmethod
+    def from_grid(cls, points, granularity, available_support, party_indices):
+        runs = []
+        for index, mandates_a, mandates_b in points:
+            if runs:
+                last_run = runs[-1]
+                if last_run[0] + last_run[1] == index and last_run[2] == mandates_a and last_run[3] == mandates_b:
+                    last_run[1] += 1
+                    continue
+            runs.append([index, 1, mandates_a, mandates_b])
+        segments = np.array([tuple(run) for run in runs], dtype=SEGMENT_DTYPE)
+        return cls(segments=segments,
+                   granularity=granularity,
+                   available_support=available_support,
+                   party_indices=party_indices)
+
+    # Build results from the output of to_dict
+    @classmethod
+    def from_dict(cls, dictionary):
+        segments = np.zeros(len(dictionary["segments"]["index"]), dtype=SEGMENT_DTYPE)
+        for name in SEGMENT_DTYPE.names:
+            segments[name] = dictionary["segments"][name]
+        return cls(segments=segments,
+                   granularity=dictionary["granularity"],
+                   available_support=dictionary["available_support"],
+                   party_indices=dictionary["party_indices"])
+
+    # Build results from the output of to_json
+    @classmethod
+    def from_json(cls, json_string):
+        return cls.from_dict(json.loads(json_string))
+
+    # Load results saved by save
+    @classmethod
+    def load(cls, file_to_load):
+        with np.load(file_to_load) as data:
+            return cls(segments=data["segments"],
+                       granularity=data["granularity"],
+                       available_support=data["available_support"],
+                       party_indices=data["party_indices"])
+
+    # Number of points on the dense grid
+    def __len__(self):
+        return int(np.sum(self.segments['length']))
+
+    # Expand segments to the dense grid as a numpy structured array (see POINT_DTYPE)
+    def to_dense(self):
+        lengths = self.segments['length']
+        segment_starts = np.cumsum(lengths) - lengths
+        offsets = np.arange(np.sum(lengths)) - np.repeat(segment_starts, lengths)
+        grid_indices = np.repeat(self.segments['index'], lengths) + offsets
+        # Accumulate the grid step like helpers.frange so supports equal the ones of calculate_elasticities
+        support_grid = np.cumsum(np.full(np.max(grid_indices) + 1 if len(grid_indices) else 0, self.granularity))
+        dense = np.zeros(len(grid_indices), dtype=POINT_DTYPE)
+        dense['support_a'] = support_grid[grid_indices]
+        dense['support_b'] = self.available_support - dense['support_a']
+        dense['mandates_a'] = np.repeat(self.segments['mandates_a'], lengths)
+        dense['mandates_b'] = np.repeat(self.segments['mandates_b'], lengths)
+        return dense
+
+    # Expand segments to the list of [support a, support b, mandates a, mandates b] rows
+    def tolist(self):
+        return [list(row) for row in self.to_dense().tolist()]
+
+    # Columnar dictionary representation of the segments
+    def to_dict(self):
+        return {"granularity": self.granularity,
+                "available_support": self.available_support,
+                "party_indices": self.party_indices,
+                "segments": dict((name, self.segments[name].tolist()) for name in SEGMENT_DTYPE.names)}
+
+    # JSON representation of the segments
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    # Save results to a binary .npz file
+    def save(self, file_to_save):
+        np.savez(file_to_save,
+                 segments=self.segments,
+                 granularity=self.granularity,
+                 available_support=self.available_support,
+                 party_indices=np.array(self.party_indices))
+
+
+class MandateResults:
+
+    calculator = None  # MandateCalculator object the stages are computed with
+    predicted_ratios = None  # Numpy array of predicted national ratios (a row per scenario for batches)
+    ratio_predicted_factual = None  # Numpy array of ratio of predicted/factual national vote values
+    num_smd_votes = None  # Numpy array of number of votes for every SMD (a matrix per scenario for batches)
+
+    # Constructor
+    def __init__(self, calculator, predicted_ratios, ratio_predicted_factual, num_smd_votes=None):
+        self.calculator = calculator
+        self.predicted_ratios = predicted_ratios
+        self.ratio_predicted_factual = ratio_predicted_factual
+        self.num_smd_votes = num_smd_votes
+        self.__stages = {}  # Cache of the stages computed so far
+
+    # Whether a stage was already computed
+    def is_computed(self, stage_name):
+        return stage_name in self.__stages
+
+    # SMD votes according to predicted national ratios
+    @property
+    def predicted_smd_votes(self):
+        return self.__stage("predicted_smd_votes",
+                            lambda: self.calculator.calculate_predicted_smd_ratios(
+                                ratio_predicted_factual=self.ratio_predicted_factual))
+
+    # SMD winners
+    @property
+    def smd_winners(self):
+        return self.__stage("smd_winners",
+                            lambda: self.calculator.determine_smd_winners(
+                                smd_predicted_array=self.predicted_smd_votes))
+
+    # SMD second largest vote ratios
+    @property
+    def smd_second_largest_votes(self):
+        return self.__stage("smd_second_largest_votes",
+                            lambda: self.calculator.determine_smd_second_largest_vote_ratios(
+                                smd_predicted_array=self.predicted_smd_votes))
+
+    # Fractional votes without winner compensation
+    @property
+    def fractional_votes_without_winner_comp(self):
+        return self.__stage("fractional_votes_without_winner_comp",
+                            lambda: self.calculator.calculate_fractional_votes_without_winner_compensation(
+                                smd_predicted_array=self.predicted_smd_votes,
+                                num_smd_votes=self.num_smd_votes))
+
+    # Fractional votes with winner compensation
+    @property
+    def fractional_votes_with_winner_comp(self):
+        return self.__stage("fractional_votes_with_winner_comp",
+                            lambda: self.calculator.calculate_fractional_votes_with_winner_compensation(
+                                smd_predicted_array=self.predicted_smd_votes,
+                                smd_winners=self.smd_winners,
+                                smd_second_largest_votes=self.smd_second_largest_votes,
+                                fractional_votes_without_winner_comp=self.fractional_votes_without_winner_comp,
+                                num_smd_votes=self.num_smd_votes))
+
+    # All list votes
+    @property
+    def all_list_votes(self):
+        return self.__stage("all_list_votes",
+                            lambda: self.calculator.calculate_all_list_votes(
+                                fractional_votes_with_winner_comp=self.fractional_votes_with_winner_comp,
+                                predicted_ratios=self.predicted_ratios,
+                                num_smd_votes=self.num_smd_votes))
+
+    # SMD mandates
+    @property
+    def smd_mandates(self):
+        return self.__stage("smd_mandates",
+                            lambda: self.calculator.calculate_smd_mandates(smd_winners=self.smd_winners))
+
+    # List mandates
+    @property
+    def list_mandates(self):
+        return self.__stage("list_mandates",
+                            lambda: self.calculator.calculate_list_mandates(all_list_votes=self.all_list_votes))
+
+    # Compute a stage on first access and return the cached value afterwards
+    def __stage(self, stage_name, calculate_stage):
+        if stage_name not in self.__stages:
+            logging.debug("Computing stage %s..." % stage_name)
+            stage = calculate_stage()
+            stage.flags.writeable = False  # Stages computed later read this one, so it must not be modified
+            self.__stages[stage_name] = stage
+        return self.__stages[stage_name]
@@ -16,6 +16,15 @@ class TestHelpers(unittest.TestCase):
                                        [0.25, 0.75],
                                        [0.1, 0.9]]))
 
+    # Test that normalize by rows leaves its input untouched
+    def test_normalize_by_rows_copy(self):
+        test_array = np.array([[1.0, 3.0],
+                               [1.0, 9.0]])
+        helpers.normalize_by_rows(test_array)
+        np_test.assert_equal(test_array,
+                             np.array([[1.0, 3.0],
+                                       [1.0, 9.0]]))
+
     # Test D'Hondt
     def test_dhondt_method(self):
         test_array = np.array([2230525, 2765331, 2512738, 457583])
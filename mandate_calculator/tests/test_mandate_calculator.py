@@ -1,9 +1,11 @@
 import unittest
 from mandate_calculator.model import MandateCalculator, MandateCalculatorException
+from mandate_calculator.results import ElasticityResults
 import pandas as pd
 import os
 import numpy as np
 import numpy.testing as np_test
+from multiprocessing.pool import ThreadPool
 
 current_dir = os.path.split(os.path.abspath(__file__))[0]
 array_of_earlier_results = pd.read_csv(os.path.join(current_dir, "files/results_2014.csv"),
@@ -341,3 +343,338 @@ class TestMandateCalculator(unittest.TestCase):
         except Exception, e:
             self.fail(e)
 
+
+    # Test that compact elasticities expand to exactly the same results as the list of elasticities
+    def test_compact_elasticities(self):
+        model = MandateCalculator(array_of_earlier_results=array_of_earlier_results,
+                                  num_smd_votes=array_of_smd_vote_counts,
+                                  factual_ratios=factual_ratios,
+                                  predicted_ratios=predicted_ratios,
+                                  votes_from_abroad=votes_from_abroad,
+                                  region_smd_array=array_of_regional_corrections)
+        for granularity in [0.1, 0.3, 0.5]:
+            for support_threshold in [None, 0.3]:
+                elasticities = model.calculate_elasticities(fixed_party_indicies=[0, 3],
+                                                            granularity=granularity,
+                                                            support_threshold=support_threshold)
+                compact_elasticities = model.calculate_compact_elasticities(fixed_party_indicies=[0, 3],
+                                                                            granularity=granularity,
+                                                                            support_threshold=support_threshold)
+                self.assertLess(len(compact_elasticities.segments), len(elasticities))
+                self.assertEqual(compact_elasticities.tolist(), elasticities)
+                self.assertEqual(ElasticityResults.from_json(compact_elasticities.to_json()).tolist(), elasticities)
+
+    # Test that calculations leave the inputs untouched and that the stored inputs are read-only
+    def test_inputs_immutable(self):
+        test_array = array_of_earlier_results.copy()
+        model = MandateCalculator(array_of_earlier_results=test_array,
+                                  num_smd_votes=array_of_smd_vote_counts,
+                                  factual_ratios=factual_ratios,
+                                  predicted_ratios=predicted_ratios,
+                                  votes_from_abroad=votes_from_abroad,
+                                  region_smd_array=array_of_regional_corrections)
+        first_smd_mandates, first_list_mandates = model.calculate_all_mandates()
+        model.calculate_predicted_smd_ratios(normalize_stepwise=False)
+        second_smd_mandates, second_list_mandates = model.calculate_all_mandates()
+        np_test.assert_equal(test_array, array_of_earlier_results)
+        np_test.assert_equal(first_smd_mandates, second_smd_mandates)
+        np_test.assert_equal(first_list_mandates, second_list_mandates)
+        with self.assertRaises(ValueError):
+            model.array_of_earlier_results[0, 0] = 0
+        with self.assertRaisesRegexp(MandateCalculatorException,
+                                     "immutable"):
+            model.predicted_ratios = np.array([0.9, 0.05, 0.03, 0.02])
+        with self.assertRaisesRegexp(MandateCalculatorException,
+                                     "immutable"):
+            del model.ratio_predicted_factual
+        np_test.assert_equal(model.predicted_ratios, predicted_ratios)
+
+    # Test that a shared model gives the same results from many threads as a separately built reference model
+    # and that neither its arrays nor the arrays of the caller change
+    def test_thread_safety(self):
+        caller_arrays = dict(array_of_earlier_results=array_of_earlier_results.copy(),
+                             num_smd_votes=array_of_smd_vote_counts.copy(),
+                             factual_ratios=factual_ratios.copy(),
+                             predicted_ratios=predicted_ratios.copy(),
+                             votes_from_abroad=votes_from_abroad.copy(),
+                             region_smd_array=array_of_regional_corrections.copy())
+        model = MandateCalculator(**caller_arrays)
+        reference_model = MandateCalculator(array_of_earlier_results=array_of_earlier_results.copy(),
+                                            num_smd_votes=array_of_smd_vote_counts.copy(),
+                                            factual_ratios=factual_ratios.copy(),
+                                            predicted_ratios=predicted_ratios.copy(),
+                                            votes_from_abroad=votes_from_abroad.copy(),
+                                            region_smd_array=array_of_regional_corrections.copy())
+        random_state = np.random.RandomState(42)
+        scenarios = random_state.uniform(size=(400, 4))
+        scenarios = scenarios / np.sum(scenarios, axis=1, keepdims=True)
+
+        def calculate(calculator, task):
+            task_type, scenario_index = task
+            scenario = scenarios[scenario_index]
+            if task_type == 0:
+                smd_mandates, list_mandates = calculator.calculate_all_mandates(
+                    predicted_ratios=scenario,
+                    ratio_predicted_factual=scenario / factual_ratios)
+                return smd_mandates + list_mandates
+            elif task_type == 1:
+                return calculator.calculate_predicted_smd_ratios(ratio_predicted_factual=scenario / factual_ratios,
+                                                                 normalize_stepwise=False)
+            elif task_type == 2:
+                return calculator.calculate_predicted_smd_ratios(ratio_predicted_factual=scenario / factual_ratios)
+            else:
+                batch = scenarios[scenario_index:scenario_index + 5]
+                results = calculator.calculate_results(predicted_ratios=batch)
+                return results.smd_mandates + results.list_mandates
+
+        tasks = [(scenario_index % 4, scenario_index) for scenario_index in range(len(scenarios))]
+        expected_results = [calculate(reference_model, task) for task in tasks]
+        pool = ThreadPool(16)
+        try:
+            threaded_results = pool.map(lambda task: calculate(model, task), tasks)
+        finally:
+            pool.close()
+            pool.join()
+        for threaded_result, expected_result in zip(threaded_results, expected_results):
+            np_test.assert_equal(threaded_result, expected_result)
+
+        np_test.assert_equal(caller_arrays["array_of_earlier_results"], array_of_earlier_results)
+        np_test.assert_equal(caller_arrays["num_smd_votes"], array_of_smd_vote_counts)
+        np_test.assert_equal(caller_arrays["factual_ratios"], factual_ratios)
+        np_test.assert_equal(caller_arrays["predicted_ratios"], predicted_ratios)
+        np_test.assert_equal(caller_arrays["votes_from_abroad"], votes_from_abroad)
+        np_test.assert_equal(caller_arrays["region_smd_array"], array_of_regional_corrections)
+        np_test.assert_equal(model.array_of_earlier_results, array_of_earlier_results)
+        np_test.assert_equal(model.num_smd_votes, array_of_smd_vote_counts)
+        np_test.assert_equal(model.predicted_ratios, predicted_ratios)
+        np_test.assert_equal(model.region_smd_array, array_of_regional_corrections)
+        np_test.assert_equal(model.ratio_predicted_factual, predicted_ratios / factual_ratios)
+
+    # Test that the lazy result object only computes the stages an output depends on
+    def test_calculate_results_lazy(self):
+        model = MandateCalculator(array_of_earlier_results=array_of_earlier_results,
+                                  num_smd_votes=array_of_smd_vote_counts,
+                                  factual_ratios=factual_ratios,
+                                  predicted_ratios=predicted_ratios,
+                                  votes_from_abroad=votes_from_abroad,
+                                  region_smd_array=array_of_regional_corrections)
+        results = model.calculate_results()
+        self.assertFalse(results.is_computed("predicted_smd_votes"))
+        smd_winners = results.smd_winners
+        self.assertTrue(results.is_computed("predicted_smd_votes"))
+        self.assertFalse(results.is_computed("fractional_votes_with_winner_comp"))
+        self.assertFalse(results.is_computed("all_list_votes"))
+        self.assertIs(results.smd_winners, smd_winners)
+        np_test.assert_almost_equal(results.all_list_votes,
+                                    np.array([2224688, 2751296, 2515307, 456522]),
+                                    decimal=0)
+        np_test.assert_equal(results.smd_mandates + results.list_mandates,
+                             np.array([45, 75, 74, 5]))
+
+    # Test that cached stages are read-only and the mandates of calculate_all_mandates are writable copies
+    def test_calculate_results_read_only(self):
+        model = MandateCalculator(array_of_earlier_results=array_of_earlier_results,
+                                  num_smd_votes=array_of_smd_vote_counts,
+                                  factual_ratios=factual_ratios,
+                                  predicted_ratios=predicted_ratios,
+                                  votes_from_abroad=votes_from_abroad,
+                                  region_smd_array=array_of_regional_corrections)
+        results = model.calculate_results()
+        with self.assertRaises(ValueError):
+            results.predicted_smd_votes[:] = 0
+        with self.assertRaises(ValueError):
+            results.list_mandates[0] = 0
+        np_test.assert_equal(results.smd_mandates + results.list_mandates,
+                             np.array([45, 75, 74, 5]))
+        smd_mandates, list_mandates = model.calculate_all_mandates()
+        smd_mandates += list_mandates
+        list_mandates += 1
+        np_test.assert_equal(smd_mandates, np.array([45, 75, 74, 5]))
+
+    # Test that a batch of predicted ratios gives the same mandates as calculating every scenario separately
+    def test_calculate_results_batch(self):
+        model = MandateCalculator(array_of_earlier_results=array_of_earlier_results,
+                                  num_smd_votes=array_of_smd_vote_counts,
+                                  factual_ratios=factual_ratios,
+                                  predicted_ratios=predicted_ratios,
+                                  votes_from_abroad=votes_from_abroad,
+                                  region_smd_array=array_of_regional_corrections)
+        scenarios = np.array([[0.26, 0.34, 0.33, 0.05],
+                              [0.88, 0.04, 0.04, 0.04],
+                              [0.30, 0.40, 0.20, 0.10]])
+        results = model.calculate_results(predicted_ratios=scenarios,
+                                          ratio_predicted_factual=scenarios / factual_ratios)
+        self.assertEqual(results.predicted_smd_votes.shape, (3, 106, 4))
+        for index, scenario in enumerate(scenarios):
+            smd_mandates, list_mandates = model.calculate_all_mandates(
+                predicted_ratios=scenario,
+                ratio_predicted_factual=scenario / factual_ratios)
+            np_test.assert_equal(results.smd_mandates[index], smd_mandates)
+            np_test.assert_equal(results.list_mandates[index], list_mandates)
+
+    # Test that a batch of predicted ratios alone derives the ratios of predicted and factual values from it
+    def test_calculate_results_batch_predicted_ratios_only(self):
+        model = MandateCalculator(array_of_earlier_results=array_of_earlier_results,
+                                  num_smd_votes=array_of_smd_vote_counts,
+                                  factual_ratios=factual_ratios,
+                                  predicted_ratios=predicted_ratios,
+                                  votes_from_abroad=votes_from_abroad,
+                                  region_smd_array=array_of_regional_corrections)
+        scenarios = np.array([[0.26, 0.34, 0.33, 0.05],
+                              [0.88, 0.04, 0.04, 0.04]])
+        results = model.calculate_results(predicted_ratios=scenarios)
+        expected_results = model.calculate_results(predicted_ratios=scenarios,
+                                                   ratio_predicted_factual=scenarios / factual_ratios)
+        self.assertEqual(results.smd_mandates.shape, (2, 4))
+        np_test.assert_equal(results.smd_mandates, expected_results.smd_mandates)
+        np_test.assert_equal(results.list_mandates, expected_results.list_mandates)
+        with self.assertRaisesRegexp(MandateCalculatorException,
+                                     "do not match"):
+            model.calculate_results(predicted_ratios=scenarios,
+                                    ratio_predicted_factual=predicted_ratios / factual_ratios)
+
+    # Test that a single scenario of predicted ratios alone keeps the ratios of predicted and factual values of the constructor
+    def test_calculate_all_mandates_single_predicted_ratios_only(self):
+        model = MandateCalculator(array_of_earlier_results=array_of_earlier_results,
+                                  num_smd_votes=array_of_smd_vote_counts,
+                                  factual_ratios=factual_ratios,
+                                  predicted_ratios=predicted_ratios,
+                                  votes_from_abroad=votes_from_abroad,
+                                  region_smd_array=array_of_regional_corrections)
+        scenario = np.array([0.30, 0.40, 0.20, 0.10])
+        smd_mandates, list_mandates = model.calculate_all_mandates(predicted_ratios=scenario)
+        expected_smd_mandates, expected_list_mandates = model.calculate_all_mandates(
+            predicted_ratios=scenario,
+            ratio_predicted_factual=predicted_ratios / factual_ratios)
+        np_test.assert_equal(smd_mandates, expected_smd_mandates)
+        np_test.assert_equal(list_mandates, expected_list_mandates)
+        np_test.assert_equal(smd_mandates, np.array([19, 43, 44, 0]))
+        np_test.assert_equal(list_mandates, np.array([28, 35, 22, 8]))
+
+    # Test that turnout scenarios give the same mandates as calculators built with the scenario vote counts
+    def test_turnout_scenarios(self):
+        model = MandateCalculator(array_of_earlier_results=array_of_earlier_results,
+                                  num_smd_votes=array_of_smd_vote_counts,
+                                  factual_ratios=factual_ratios,
+                                  predicted_ratios=predicted_ratios,
+                                  votes_from_abroad=votes_from_abroad,
+                                  region_smd_array=array_of_regional_corrections)
+        polls = np.array([[0.26, 0.34, 0.33, 0.05],
+                          [0.30, 0.40, 0.20, 0.10]])
+        random_state = np.random.RandomState(42)
+        turnout_multipliers = random_state.uniform(low=0.7, high=1.3, size=(3, 106, 1))
+        results = model.calculate_results(predicted_ratios=np.expand_dims(polls, axis=1),
+                                          ratio_predicted_factual=np.expand_dims(polls / factual_ratios, axis=1),
+                                          turnout_multipliers=turnout_multipliers)
+        self.assertEqual(results.list_mandates.shape, (2, 3, 4))
+        self.assertEqual(results.smd_mandates.shape, (2, 1, 4))
+        all_smd_mandates, all_list_mandates = model.calculate_all_mandates(
+            predicted_ratios=np.expand_dims(polls, axis=1),
+            ratio_predicted_factual=np.expand_dims(polls / factual_ratios, axis=1),
+            turnout_multipliers=turnout_multipliers)
+        self.assertEqual(all_smd_mandates.shape, (2, 3, 4))
+        self.assertEqual(all_list_mandates.shape, (2, 3, 4))
+        for poll_index, poll in enumerate(polls):
+            for turnout_index, multipliers in enumerate(turnout_multipliers):
+                turnout_model = MandateCalculator(array_of_earlier_results=array_of_earlier_results,
+                                                  num_smd_votes=array_of_smd_vote_counts * multipliers,
+                                                  factual_ratios=factual_ratios,
+                                                  predicted_ratios=poll,
+                                                  votes_from_abroad=votes_from_abroad,
+                                                  region_smd_array=array_of_regional_corrections)
+                all_list_votes = turnout_model.calculate_results().all_list_votes
+                np_test.assert_almost_equal(results.all_list_votes[poll_index, turnout_index],
+                                            all_list_votes,
+                                            decimal=0)
+                smd_mandates, list_mandates = turnout_model.calculate_all_mandates()
+                np_test.assert_equal(all_list_mandates[poll_index, turnout_index], list_mandates)
+                np_test.assert_equal(all_smd_mandates[poll_index, turnout_index], smd_mandates)
+
+    # Test that SMD and list mandates have matching shapes for a single poll with turnout scenarios
+    def test_turnout_scenarios_single_poll(self):
+        model = MandateCalculator(array_of_earlier_results=array_of_earlier_results,
+                                  num_smd_votes=array_of_smd_vote_counts,
+                                  factual_ratios=factual_ratios,
+                                  predicted_ratios=predicted_ratios,
+                                  votes_from_abroad=votes_from_abroad,
+                                  region_smd_array=array_of_regional_corrections)
+        smd_mandates, list_mandates = model.calculate_all_mandates(turnout_multipliers=np.ones((3, 106, 1)))
+        self.assertEqual(smd_mandates.shape, (3, 4))
+        self.assertEqual(list_mandates.shape, (3, 4))
+        np_test.assert_equal(smd_mandates + list_mandates,
+                             np.tile(np.array([45, 75, 74, 5]), (3, 1)))
+
+    # Test that absolute turnout counts and turnout multipliers are interchangeable
+    def test_turnout_counts(self):
+        model = MandateCalculator(array_of_earlier_results=array_of_earlier_results,
+                                  num_smd_votes=array_of_smd_vote_counts,
+                                  factual_ratios=factual_ratios,
+                                  predicted_ratios=predicted_ratios,
+                                  votes_from_abroad=votes_from_abroad,
+                                  region_smd_array=array_of_regional_corrections)
+        from_counts = model.calculate_results(num_smd_votes=array_of_smd_vote_counts * 1.2)
+        from_multipliers = model.calculate_results(turnout_multipliers=np.full((106, 1), 1.2))
+        np_test.assert_almost_equal(from_counts.all_list_votes,
+                                    from_multipliers.all_list_votes,
+                                    decimal=0)
+        with self.assertRaisesRegexp(MandateCalculatorException,
+                                     "turnout multipliers"):
+            model.calculate_results(turnout_multipliers=np.ones(106))
+        polls = np.array([[0.26, 0.34, 0.33, 0.05],
+                          [0.30, 0.40, 0.20, 0.10]])
+        with self.assertRaisesRegexp(MandateCalculatorException,
+                                     "\\(n, 1, 4\\)"):
+            model.calculate_results(predicted_ratios=polls,
+                                    turnout_multipliers=np.ones((3, 106, 1)))
+        with self.assertRaisesRegexp(MandateCalculatorException,
+                                     "cannot be broadcast"):
+            model.calculate_all_mandates(predicted_ratios=polls,
+                                         num_smd_votes=np.ones((3, 106, 1)))
+
+    # Test that streamed elasticity chunks match calculating every grid point separately
+    def test_iterate_elasticities(self):
+        model = MandateCalculator(array_of_earlier_results=array_of_earlier_results,
+                                  num_smd_votes=array_of_smd_vote_counts,
+                                  factual_ratios=factual_ratios,
+                                  predicted_ratios=predicted_ratios,
+                                  votes_from_abroad=votes_from_abroad,
+                                  region_smd_array=array_of_regional_corrections)
+        chunks = list(model.iterate_elasticities(fixed_party_indicies=[0, 3],
+                                                 granularity=0.5,
+                                                 support_threshold=0.3,
+                                                 chunk_size=7))
+        self.assertTrue(all(len(chunk) == 7 for chunk in chunks[:-1]))
+        self.assertTrue(0 < len(chunks[-1]) <= 7)
+        for party_a_support, party_b_support, mandates_a, mandates_b in [row for chunk in chunks for row in chunk]:
+            self.assertLessEqual(abs(party_a_support - party_b_support) / 100, 0.3)
+            scenario = predicted_ratios.copy()
+            scenario[[1, 2]] = [party_a_support / 100, party_b_support / 100]
+            smd_mandates, list_mandates = model.calculate_all_mandates(predicted_ratios=scenario,
+                                                                       ratio_predicted_factual=scenario / factual_ratios)
+            self.assertEqual([mandates_a, mandates_b], (smd_mandates + list_mandates)[[1, 2]].tolist())
+        self.assertEqual([row for chunk in chunks for row in chunk],
+                         model.calculate_elasticities(fixed_party_indicies=[0, 3],
+                                                      granularity=0.5,
+                                                      support_threshold=0.3))
+
+    # Test that invalid elasticity arguments raise on the call itself, before iterating
+    def test_iterate_elasticities_validation(self):
+        model = MandateCalculator(array_of_earlier_results=array_of_earlier_results,
+                                  num_smd_votes=array_of_smd_vote_counts,
+                                  factual_ratios=factual_ratios,
+                                  predicted_ratios=predicted_ratios,
+                                  votes_from_abroad=votes_from_abroad,
+                                  region_smd_array=array_of_regional_corrections)
+        with self.assertRaisesRegexp(MandateCalculatorException,
+                                     "as a list"):
+            model.iterate_elasticities(fixed_party_indicies=(0, 3))
+        with self.assertRaisesRegexp(MandateCalculatorException,
+                                     "two fixed parties"):
+            model.iterate_elasticities(fixed_party_indicies=[0])
+        for chunk_size in [0, -1, 2.5, True, "10"]:
+            with self.assertRaisesRegexp(MandateCalculatorException,
+                                         "positive integer"):
+                model.iterate_elasticities(fixed_party_indicies=[0, 3], chunk_size=chunk_size)
+        with self.assertRaisesRegexp(MandateCalculatorException,
+                                     "positive integer"):
+            model.calculate_compact_elasticities(fixed_party_indicies=[0, 3], chunk_size=0)
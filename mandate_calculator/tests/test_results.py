@@ -0,0 +1,54 @@
+import unittest
+import tempfile
+import os
+import numpy as np
+import numpy.testing as np_test
+from mandate_calculator.results import ElasticityResults
+
+points = [(0, 10, 20), (1, 10, 20), (2, 11, 19), (4, 11, 19), (5, 11, 19)]
+
+class TestElasticityResults(unittest.TestCase):
+
+    # Test that runs of constant mandates are merged and gaps in the grid start new segments
+    def test_from_grid(self):
+        results = ElasticityResults.from_grid(points=points,
+                                              granularity=0.5,
+                                              available_support=10.0,
+                                              party_indices=[1, 2])
+        np_test.assert_equal(results.segments['index'], np.array([0, 2, 4]))
+        np_test.assert_equal(results.segments['length'], np.array([2, 1, 2]))
+        np_test.assert_equal(results.segments['mandates_a'], np.array([10, 11, 11]))
+        self.assertEqual(len(results), 5)
+
+    # Test expansion to the dense grid
+    def test_tolist(self):
+        results = ElasticityResults.from_grid(points=points,
+                                              granularity=0.5,
+                                              available_support=10.0,
+                                              party_indices=[1, 2])
+        self.assertEqual(results.tolist(),
+                         [[0.5, 9.5, 10, 20],
+                          [1.0, 9.0, 10, 20],
+                          [1.5, 8.5, 11, 19],
+                          [2.5, 7.5, 11, 19],
+                          [3.0, 7.0, 11, 19]])
+
+    # Test that results survive a JSON and an .npz round trip
+    def test_serialization(self):
+        results = ElasticityResults.from_grid(points=points,
+                                              granularity=0.5,
+                                              available_support=10.0,
+                                              party_indices=[1, 2])
+        from_json = ElasticityResults.from_json(results.to_json())
+        np_test.assert_equal(from_json.segments, results.segments)
+        self.assertEqual(from_json.party_indices, [1, 2])
+
+        temp_dir = tempfile.mkdtemp()
+        file_name = os.path.join(temp_dir, "elasticities.npz")
+        results.save(file_name)
+        loaded = ElasticityResults.load(file_name)
+        os.remove(file_name)
+        os.rmdir(temp_dir)
+        np_test.assert_equal(loaded.segments, results.segments)
+        self.assertEqual(loaded.granularity, 0.5)
+        self.assertEqual(loaded.tolist(), results.tolist())